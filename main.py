@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 import discord
+import aiohttp
 import asyncio
+import errno
 import json
 import os
-import subprocess
 import textwrap
 import threading
-import queue
 import tempfile
+import time
 import logging
+import mmap
+import concurrent.futures
+import select
+import shutil
 import sys
+from collections import defaultdict, deque
+from itertools import islice
 from typing import List, Optional
 
 # ---------- Color support ----------
@@ -32,14 +39,68 @@ except Exception:
     Fore = _F()
     Style = _F()
 
+# ---------- Fast JSON (optional) ----------
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
+def dumps_json(data, compact: bool = True) -> bytes:
+    # default=list lets conversation deques serialize without copying them first
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS if compact else orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(data, option=option, default=list)
+    if compact:
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=list).encode("utf-8")
+    return json.dumps(data, indent=2, ensure_ascii=False, default=list).encode("utf-8")
+
+def loads_json(raw: bytes):
+    if ORJSON_AVAILABLE:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 # ---------- Configuration ----------
 CONFIG_FILE = "config.json"
 KNOWN_USERS_FILE = "known_users.json"
+KNOWN_USERS_LOG = "known_users.log"
 CONVERSATIONS_FILE = "conversations.json"
+CONVERSATIONS_LOG = "conversations.jsonl"
 
 HISTORY_FETCH_LIMIT = None
-HISTORY_CONCURRENCY = 3
+HISTORY_CONCURRENCY = 16
 HISTORY_FETCH_TIMEOUT = 120
+# Requests per second issued by a history reload, and the cap on 429 backoff
+HISTORY_RATE_LIMIT = 50
+RATE_LIMIT_MAX_BACKOFF = 60
+RATE_LIMIT_MAX_RETRIES = 5
+
+# Per-user message buffer size; older messages are dropped from memory and disk
+CONVERSATION_MAXLEN = 2000
+CONVERSATION_DISPLAY_LIMIT = 200
+
+# Worker threads for to_thread (disk flushes, loads); override with the THREAD_POOL_SIZE env var
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "16"))
+
+UPDATE_REPO_DIR = os.path.expanduser("~/Discord-DM-Bot")
+UPDATE_REPO_BRANCH = "main"
+# Latest commit SHA on the branch, checked before spawning git so an up-to-date repo skips the pull
+UPDATE_REPO_API = f"https://api.github.com/repos/developer51709/Discord-DM-Bot/commits/{UPDATE_REPO_BRANCH}"
+UPDATE_CHECK_TIMEOUT = 10
+GIT_PULL_TIMEOUT = 60
+# How long the CLI waits for a reply to be sent; a reply still queued by then is withdrawn
+REPLY_TIMEOUT = 20
+
+# Delay after the first change before writing, so a burst of messages becomes one write
+PERSIST_DEBOUNCE = 0.5
+# Journal records appended before conversations.json is rewritten and the journal truncated
+JOURNAL_COMPACT_RECORDS = 5000
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+JOURNAL_BUFFER_SIZE = 1 << 16
+# Files at least this large are parsed straight from a read-only mmap when orjson is available
+MMAP_LOAD_THRESHOLD = 64 * 1024
+# Ids appended to known_users.log before known_users.json is rewritten and the log truncated
+KNOWN_USERS_COMPACT_RECORDS = 1000
 
 # ------- Logging (to stderr) -------
 handler = logging.StreamHandler(sys.stderr)
@@ -58,52 +119,164 @@ intents.dm_messages = True
 client = discord.Client(intents=intents)
 
 #  Shared state and synchronization 
-incoming_queue = queue.Queue()
-unread_count = 0
+# Messages received per user since that conversation was last opened in the CLI
+unread_by_user = defaultdict(int)
+# Sum of unread_by_user, kept alongside it so the status line doesn't re-add every count
+unread_total = 0
 unread_lock = threading.Lock()
 
 conversations = {}
 conversations_lock = threading.Lock()
 
+# Bumped on every change to a conversation; rendered_cache entries are (version, wrapped messages)
+conversation_versions = {}
+rendered_cache = {}
+
+# Cached output of list_conversations; rebuilt only after a conversation or unread count changes
+_summary_lines = []
+_summary_dirty = True
+
+known_users = set()
+known_users_lock = threading.Lock()
+# New ids not yet appended to known_users.log (guarded by known_users_lock), and ids in the log
+_known_pending = []
+_known_log_records = 0
+known_io_lock = threading.Lock()
+
+# Set when in-memory state is ahead of disk; flushed by _persist_loop
+_conv_dirty = False
+_known_dirty = False
+persist_task: Optional[asyncio.Task] = None
+
+# Outgoing replies as (uid, text, future); one consumer sends them in order, and the bound
+# makes submitters wait instead of piling up sends behind a rate limit
+OUTBOX_MAXSIZE = 100
+outbox: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_MAXSIZE)
+outbox_task: Optional[asyncio.Task] = None
+persist_wakeup = asyncio.Event()
+main_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Append-only journal of messages not yet in conversations.json. record_message only queues
+# encoded records in _journal_pending (under conversations_lock); the file itself is written by
+# the flush thread under journal_io_lock, so the event loop never waits on the disk.
+_journal_fp = None
+_journal_pending = []
+_journal_records = 0
+_journal_bytes = 0
+journal_io_lock = threading.Lock()
+
 shutdown_event = threading.Event()
 
+# Set when the menu's status lines are stale; the CLI repaints them while waiting for input
+ui_dirty = threading.Event()
+
 bot_status = ""
 bot_status_lock = threading.Lock()
 
 bot_ready_event: Optional[asyncio.Event] = None
+# Thread-side mirror of bot_ready_event for the CLI thread
+bot_ready_flag = threading.Event()
 
 # ------ Utility: atomic save ------
-def atomic_save(path: str, data) -> None:
+def fsync_dir(dirn: str) -> None:
+    # Makes a completed rename survive power loss; directories can't be opened on Windows
+    try:
+        dfd = os.open(dirn, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except OSError:
+        return
+    try:
+        os.fsync(dfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dfd)
+
+# Linux: write into an unnamed O_TMPFILE and link it in only once complete, so a writer that
+# dies mid-save leaves no temp file behind. Disabled after the first failure (e.g. unsupported fs).
+_tmpfile_supported = hasattr(os, "O_TMPFILE") and os.path.isdir("/proc/self/fd")
+# Errors meaning the filesystem or kernel can't do O_TMPFILE + link at all (EISDIR: pre-3.11 kernels,
+# ENOENT: no /proc); anything else, e.g. ENOSPC or EIO, only skips O_TMPFILE for that one save
+_TMPFILE_UNSUPPORTED = {errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL, errno.ENOENT}
+
+def write_fd(fd: int, payload: bytes, durable: bool) -> None:
+    with os.fdopen(fd, "wb", closefd=False) as f:
+        f.write(payload)
+    if durable:
+        os.fsync(fd)
+
+def link_tmpfile(dirn: str, path: str, payload: bytes, durable: bool) -> str:
+    fd = os.open(dirn, os.O_TMPFILE | os.O_WRONLY, 0o600)
+    try:
+        write_fd(fd, payload, durable)
+        tmp = os.path.join(dirn, f".{os.path.basename(path)}.{os.urandom(4).hex()}.tmp")
+        os.link(f"/proc/self/fd/{fd}", tmp)
+    finally:
+        os.close(fd)
+    return tmp
+
+# Without durable the rename is still atomic against process crashes; durable adds the file and
+# directory fsyncs needed to survive power loss, which only config.json pays for
+def atomic_save(path: str, data, compact: bool = True, durable: bool = False) -> None:
+    atomic_write(path, dumps_json(data, compact=compact), durable)
+
+def atomic_write(path: str, payload: bytes, durable: bool = False) -> None:
+    global _tmpfile_supported
     dirn = os.path.dirname(path) or "."
-    fd, tmp = tempfile.mkstemp(dir=dirn)
+    tmp = None
+    if _tmpfile_supported:
+        try:
+            tmp = link_tmpfile(dirn, path, payload, durable)
+        except OSError as e:
+            logger.debug("O_TMPFILE save failed for %s (%s); using mkstemp", path, e)
+            if e.errno in _TMPFILE_UNSUPPORTED:
+                _tmpfile_supported = False
     try:
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-            f.flush()
-            os.fsync(f.fileno())
+        if tmp is None:
+            fd, tmp = tempfile.mkstemp(dir=dirn)
+            try:
+                write_fd(fd, payload, durable)
+            finally:
+                os.close(fd)
         os.replace(tmp, path)
     except Exception:
         try:
-            if os.path.exists(tmp):
+            if tmp is not None and os.path.exists(tmp):
                 os.remove(tmp)
         except Exception:
             pass
         raise
+    if durable:
+        fsync_dir(dirn)
 
 # ----------- Persistence -----------
+def read_json_file(f):
+    if ORJSON_AVAILABLE and os.fstat(f.fileno()).st_size >= MMAP_LOAD_THRESHOLD:
+        # orjson parses from the mapped pages directly, skipping the read() copy
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+        else:
+            try:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
+            finally:
+                mm.close()
+    return loads_json(f.read())
+
 def load_json(path: str, default):
     if os.path.exists(path):
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(path, "rb") as f:
+                return read_json_file(f)
         except Exception as e:
             logger.warning("Failed to load %s: %s", path, e)
             return default
     return default
 
-def save_json_atomic(path: str, data):
+def save_json_atomic(path: str, data, compact: bool = True, durable: bool = False):
     try:
-        atomic_save(path, data)
+        atomic_save(path, data, compact=compact, durable=durable)
     except Exception as e:
         logger.exception("Failed to save %s: %s", path, e)
 
@@ -114,32 +287,316 @@ def load_known_users() -> List[int]:
     except Exception:
         return []
 
-def save_known_users_sync(user_ids: List[int]):
-    save_json_atomic(KNOWN_USERS_FILE, [int(x) for x in user_ids])
-
-async def save_known_users(user_ids: List[int]):
-    await asyncio.to_thread(save_known_users_sync, user_ids)
+def load_known_users_log():
+    # Returns (ids, torn); a final line without its newline is a crash mid-append
+    ids = []
+    torn = False
+    if os.path.exists(KNOWN_USERS_LOG):
+        try:
+            with open(KNOWN_USERS_LOG, "rb") as f:
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        torn = True
+                        continue
+                    try:
+                        ids.append(int(raw))
+                    except ValueError:
+                        continue
+        except Exception as e:
+            logger.warning("Failed to replay %s: %s", KNOWN_USERS_LOG, e)
+    return ids, torn
+
+# Conversation entries are (author, content) tuples; author strings are interned so
+# each author's name is stored once however many messages they send
+def make_entry(author: str, content: str):
+    return (sys.intern(author), content)
+
+def parse_entry(item):
+    if isinstance(item, str):
+        # Pre-tuple format: "author: content" (Discord names cannot contain ':')
+        author, sep, content = item.partition(": ")
+        return make_entry(author, content) if sep else make_entry("", item)
+    return make_entry(item[0], item[1])
+
+def conversation_buffer(store: dict, uid: int) -> deque:
+    # Like setdefault, but without building a throwaway deque when uid already exists
+    buf = store.get(uid)
+    if buf is None:
+        buf = store[uid] = deque(maxlen=CONVERSATION_MAXLEN)
+    return buf
+
+def invalidate_summary():
+    global _summary_dirty
+    _summary_dirty = True
+
+def format_entry(entry) -> str:
+    author, content = entry
+    return f"{author}: {content}" if author else content
+
+def open_journal():
+    return open(CONVERSATIONS_LOG, "ab", buffering=JOURNAL_BUFFER_SIZE)
+
+def journal_needs_compaction() -> bool:
+    return _journal_records >= JOURNAL_COMPACT_RECORDS or _journal_bytes >= JOURNAL_COMPACT_BYTES
 
 def load_conversations_sync():
-    global conversations
+    global conversations, _journal_records, _journal_bytes
     data = load_json(CONVERSATIONS_FILE, {})
+    loaded = {
+        int(k): deque((parse_entry(item) for item in v), maxlen=CONVERSATION_MAXLEN)
+        for k, v in data.items()
+    }
+    replayed = 0
+    replayed_bytes = 0
+    torn = False
+    if os.path.exists(CONVERSATIONS_LOG):
+        try:
+            with open(CONVERSATIONS_LOG, "rb") as f:
+                for raw in f:
+                    replayed_bytes += len(raw)
+                    if not raw.endswith(b"\n"):
+                        # Crash mid-append: even if the record parses, the next append would
+                        # land on this line, so force a snapshot below
+                        torn = True
+                    try:
+                        rec = loads_json(raw)
+                    except ValueError:
+                        torn = True
+                        continue
+                    if isinstance(rec, list):
+                        uid, entry = rec[0], make_entry(rec[1], rec[2])
+                    else:
+                        # Older dict records, either {"uid","author","content"} or {"uid","line"}
+                        uid = rec["uid"]
+                        entry = parse_entry(rec["line"]) if "line" in rec else make_entry(rec["author"], rec["content"])
+                    conversation_buffer(loaded, int(uid)).append(entry)
+                    replayed += 1
+        except Exception as e:
+            logger.warning("Failed to replay %s: %s", CONVERSATIONS_LOG, e)
     with conversations_lock:
-        conversations = {int(k): v for k, v in data.items()}
+        conversations = loaded
+        _journal_records = replayed
+        _journal_bytes = replayed_bytes
+        conversation_versions.clear()
+        rendered_cache.clear()
+    invalidate_summary()
+    if torn:
+        # New appends would land on the same line as the torn record; fold everything into a snapshot now
+        save_conversations_sync()
 
-def save_conversations_sync():
+def take_journal_pending() -> list:
+    global _journal_pending
     with conversations_lock:
-        save_json_atomic(CONVERSATIONS_FILE, conversations)
+        batch, _journal_pending = _journal_pending, []
+    return batch
+
+def write_journal_sync(batch: list):
+    # Caller holds journal_io_lock
+    global _journal_fp, _journal_records
+    if not batch:
+        return
+    try:
+        if _journal_fp is None:
+            _journal_fp = open_journal()
+        _journal_fp.write(b"".join(batch))
+        _journal_fp.flush()
+    except Exception as e:
+        _journal_fp = None
+        logger.exception("Failed to append to %s: %s", CONVERSATIONS_LOG, e)
+        # Force a full snapshot on the next flush so these messages still reach disk
+        with conversations_lock:
+            _journal_records = max(_journal_records, JOURNAL_COMPACT_RECORDS)
+
+# Full snapshot to conversations.json; the journal is truncated once the snapshot is in place.
+# Only the encode runs under conversations_lock; the write happens after it is released.
+def save_conversations_sync():
+    global _journal_fp, _journal_pending, _journal_records, _journal_bytes
+    with journal_io_lock:
+        with conversations_lock:
+            payload = dumps_json(conversations)
+            # Queued records are part of this snapshot, so they never need to reach the journal
+            batch, _journal_pending = _journal_pending, []
+            records, nbytes = _journal_records, _journal_bytes
+            _journal_records = 0
+            _journal_bytes = 0
+        try:
+            # Not durable: an OS crash right after compaction can lose recent history
+            atomic_write(CONVERSATIONS_FILE, payload)
+        except Exception as e:
+            logger.exception("Failed to save %s: %s", CONVERSATIONS_FILE, e)
+            with conversations_lock:
+                _journal_records += records
+                _journal_bytes += nbytes
+            write_journal_sync(batch)
+            return
+        try:
+            # Truncate through the long-lived append handle rather than reopening the file
+            if _journal_fp is None:
+                _journal_fp = open_journal()
+            _journal_fp.truncate(0)
+        except Exception as e:
+            _journal_fp = None
+            logger.exception("Failed to truncate %s: %s", CONVERSATIONS_LOG, e)
+            # Retry on the next flush; until then a restart replays duplicates of snapshotted messages
+            with conversations_lock:
+                _journal_records = max(_journal_records, JOURNAL_COMPACT_RECORDS)
 
 async def save_conversations():
     await asyncio.to_thread(save_conversations_sync)
 
+def flush_journal_sync():
+    with journal_io_lock:
+        write_journal_sync(take_journal_pending())
+
+# Appends in memory and queues a journal record; the debounced writer puts it on disk
+def record_message(uid: int, author: str, content: str):
+    global _conv_dirty, _journal_records, _journal_bytes
+    entry = make_entry(author, content)
+    # Journal records are compact [uid, author, content] arrays
+    rec = dumps_json([uid, author, content]) + b"\n"
+    with conversations_lock:
+        conversation_buffer(conversations, uid).append(entry)
+        conversation_versions[uid] = conversation_versions.get(uid, 0) + 1
+        invalidate_summary()
+        _journal_pending.append(rec)
+        _journal_records += 1
+        _journal_bytes += len(rec)
+    _conv_dirty = True
+    wake_persist()
+
+def load_known_users_sync():
+    global _known_log_records
+    ids = load_known_users()
+    logged, torn = load_known_users_log()
+    with known_users_lock:
+        known_users.update(ids)
+        known_users.update(logged)
+        _known_log_records = len(logged)
+    if torn:
+        # New appends would land on the same line as the torn id; fold everything into a snapshot now
+        save_known_users_sync()
+
+# Rewrites known_users.json from memory, then empties the log it now covers
+def save_known_users_sync():
+    global _known_pending, _known_log_records
+    with known_io_lock:
+        with known_users_lock:
+            ids = sorted(known_users)
+            batch, _known_pending = _known_pending, []
+            logged = _known_log_records
+            _known_log_records = 0
+        try:
+            atomic_save(KNOWN_USERS_FILE, ids)
+            # Reopening in "wb" truncates the log
+            open(KNOWN_USERS_LOG, "wb").close()
+        except Exception as e:
+            logger.exception("Failed to save %s: %s", KNOWN_USERS_FILE, e)
+            with known_users_lock:
+                _known_pending[:0] = batch
+                _known_log_records += logged
+
+def flush_known_users_sync():
+    global _known_pending, _known_log_records
+    with known_io_lock:
+        with known_users_lock:
+            batch, _known_pending = _known_pending, []
+            compact = _known_log_records + len(batch) >= KNOWN_USERS_COMPACT_RECORDS
+        if compact:
+            with known_users_lock:
+                _known_pending[:0] = batch
+        else:
+            try:
+                with open(KNOWN_USERS_LOG, "ab") as f:
+                    f.write(b"".join(b"%d\n" % uid for uid in batch))
+                with known_users_lock:
+                    _known_log_records += len(batch)
+                return
+            except Exception as e:
+                logger.exception("Failed to append to %s: %s", KNOWN_USERS_LOG, e)
+                with known_users_lock:
+                    _known_pending[:0] = batch
+    # Log full or unwritable: fold everything into a snapshot instead
+    save_known_users_sync()
+
+def add_known_users(uids) -> int:
+    # Batch form of add_known_user: one lock acquisition and at most one wakeup
+    global _known_dirty
+    with known_users_lock:
+        new = set(uids) - known_users
+        known_users.update(new)
+        _known_pending.extend(new)
+    if new:
+        _known_dirty = True
+        wake_persist()
+    return len(new)
+
+def add_known_user(uid: int) -> bool:
+    global _known_dirty
+    with known_users_lock:
+        if uid in known_users:
+            return False
+        known_users.add(uid)
+        _known_pending.append(uid)
+    _known_dirty = True
+    wake_persist()
+    return True
+
+# ------ Debounced persistence ------
+def flush_dirty_sync():
+    global _conv_dirty, _known_dirty
+    # Clear the flags before writing so changes made mid-save are picked up next round
+    if _conv_dirty:
+        _conv_dirty = False
+        if journal_needs_compaction():
+            save_conversations_sync()
+        else:
+            flush_journal_sync()
+    if _known_dirty:
+        _known_dirty = False
+        flush_known_users_sync()
+
+def wake_persist():
+    # Callable from the loop or the CLI thread; asyncio.Event itself is not thread-safe
+    if main_loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is main_loop:
+        persist_wakeup.set()
+    else:
+        main_loop.call_soon_threadsafe(persist_wakeup.set)
+
+async def _persist_loop():
+    while True:
+        await persist_wakeup.wait()
+        await asyncio.sleep(PERSIST_DEBOUNCE)
+        # Cleared after the debounce so everything that arrived during it shares this write
+        persist_wakeup.clear()
+        await asyncio.to_thread(flush_dirty_sync)
+
 # -------- Config management --------
+# Parsed config.json, read once; save_token keeps it in step with the file
+_config_cache: Optional[dict] = None
+
+def get_config() -> dict:
+    global _config_cache
+    if _config_cache is None:
+        cfg = load_json(CONFIG_FILE, {})
+        _config_cache = cfg if isinstance(cfg, dict) else {}
+    return _config_cache
+
 def load_token() -> Optional[str]:
-    cfg = load_json(CONFIG_FILE, {})
-    return cfg.get("token")
+    return get_config().get("token")
 
 def save_token(token: str):
-    save_json_atomic(CONFIG_FILE, {"token": token})
+    cfg = get_config()
+    if cfg.get("token") == token:
+        return
+    cfg["token"] = token
+    # Pretty-printed: config.json is the one file users edit by hand
+    save_json_atomic(CONFIG_FILE, cfg, compact=False, durable=True)
 
 def get_token_interactive() -> str:
     token = load_token()
@@ -150,243 +607,553 @@ def get_token_interactive() -> str:
             save_token(token)
     return token
 
+# ---------- Rate limiting ----------
+class RateLimiter:
+    # Token bucket: on average `rate` acquisitions per `per` seconds, bursting up to `rate`, shared
+    # by every route. A 429 blocks only its own route (user, dm, history) until the reset window ends.
+    def __init__(self, rate: float, per: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.blocked_until = defaultdict(float)
+        self.lock = asyncio.Lock()
+
+    def block_for(self, route: str, delay: float):
+        # Every caller of the route waits out the window the 429 reported
+        self.blocked_until[route] = max(self.blocked_until[route], time.monotonic() + delay)
+
+    async def acquire(self, route: str):
+        # Wait out the route's block before queueing on the shared bucket, so other routes keep going
+        while True:
+            remaining = self.blocked_until[route] - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+class AdmissionController:
+    # Concurrency cap that, unlike asyncio.Semaphore, can be resized while tasks hold slots.
+    # Halved on a new rate-limit window, then raised by one per successful call up to max_cap.
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.max_cap = cap
+        self.active = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.active < self.cap)
+            self.active += 1
+
+    async def release(self):
+        async with self.cond:
+            self.active -= 1
+            self.cond.notify(1)
+
+    async def set_cap(self, cap: int):
+        async with self.cond:
+            self.cap = max(1, min(cap, self.max_cap))
+            self.cond.notify_all()
+
+    async def grow(self):
+        if self.cap < self.max_cap:
+            await self.set_cap(self.cap + 1)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+def retry_after_seconds(e: discord.HTTPException) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    for name in ("X-RateLimit-Reset-After", "Retry-After"):
+        try:
+            return float(headers[name])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+async def call_rate_limited(limiter: RateLimiter, route: str, make_call, admission: Optional[AdmissionController] = None):
+    # make_call builds a fresh coroutine per attempt; 429s block the route (doubling, capped)
+    # and retry. The first 429 of a window halves the admission cap; successes win it back.
+    backoff = 1.0
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        await limiter.acquire(route)
+        try:
+            result = await make_call()
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            delay = min(retry_after_seconds(e) or backoff, RATE_LIMIT_MAX_BACKOFF)
+            # Tasks already in flight hit the same window; only the first of them shrinks the cap
+            new_window = limiter.blocked_until[route] <= time.monotonic()
+            if admission is not None and new_window and admission.cap > 1:
+                await admission.set_cap(admission.cap // 2)
+                logger.info("Reduced reload concurrency to %d", admission.cap)
+            logger.warning("Rate limited; retrying in %.1fs", delay)
+            limiter.block_for(route, delay)
+            backoff = min(backoff * 2, RATE_LIMIT_MAX_BACKOFF)
+        else:
+            if admission is not None:
+                await admission.grow()
+            return result
+
 # --------- Discord helpers ---------
-async def fetch_channel_history(channel: discord.DMChannel, limit: Optional[int] = HISTORY_FETCH_LIMIT):
-    msgs = []
+async def iter_channel_history(channel: discord.DMChannel, limit: Optional[int] = HISTORY_FETCH_LIMIT):
+    # Converts each message to an entry as it streams in, so Message objects are freed page by page
+    async for m in channel.history(limit=limit, oldest_first=True):
+        yield make_entry(str(m.author), m.content)
+
+async def fetch_channel_history_entries(channel: discord.DMChannel, limit: Optional[int] = HISTORY_FETCH_LIMIT):
+    # At most CONVERSATION_MAXLEN entries are held however long the history is
+    entries = deque(maxlen=CONVERSATION_MAXLEN)
     try:
-        async for m in channel.history(limit=limit, oldest_first=True):
-            msgs.append(m)
+        async for entry in iter_channel_history(channel, limit):
+            entries.append(entry)
+        return entries
+    except discord.HTTPException as e:
+        if e.status == 429:
+            # Let call_rate_limited back off and retry
+            raise
+        logger.exception("Error fetching history for channel %s: %s", getattr(channel, "id", "<dm>"), e)
+        return []
     except Exception as e:
         logger.exception("Error fetching history for channel %s: %s", getattr(channel, "id", "<dm>"), e)
-    return msgs
+        return []
+
+# ---------- Self-update ----------
+def read_local_head(cwd: str) -> Optional[str]:
+    # Resolves HEAD from .git directly (loose ref, then packed-refs) instead of running git rev-parse
+    git_dir = os.path.join(cwd, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r", encoding="utf-8") as f:
+            head = f.read().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[5:]
+        ref_path = os.path.join(git_dir, *ref.split("/"))
+        if os.path.exists(ref_path):
+            with open(ref_path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, "packed-refs"), "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return None
+
+async def fetch_remote_head() -> Optional[str]:
+    # The vnd.github.sha media type returns just the 40-character SHA as the body
+    try:
+        timeout = aiohttp.ClientTimeout(total=UPDATE_CHECK_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(UPDATE_REPO_API, headers={"Accept": "application/vnd.github.sha"}) as resp:
+                if resp.status != 200:
+                    return None
+                return (await resp.text()).strip()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Update check failed: %s", e)
+        return None
+
+async def git_pull(cwd: str):
+    local = await asyncio.to_thread(read_local_head, cwd)
+    if local is not None and local == await fetch_remote_head():
+        return "Already up to date.", ""
+    # Unknown on either side (offline API, detached checkout, ...) falls through to a real pull
+    proc = await asyncio.create_subprocess_exec(
+        "git", "pull", "origin", UPDATE_REPO_BRANCH,
+        cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout=GIT_PULL_TIMEOUT)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # A hung network fetch would otherwise leave git running after we give up on it
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+        raise
+    return out.decode(errors="replace"), err.decode(errors="replace")
+
+# Users resolved via REST, so later replies and reloads skip fetch_user
+_user_cache = {}
+# One in-flight fetch_user per uid; concurrent callers wait for it instead of issuing their own
+_user_fetch_locks = defaultdict(asyncio.Lock)
+# DM channels opened via create_dm, kept across reloads; dropped when Discord reports NotFound
+_dm_cache = {}
+
+async def resolve_user(uid: int):
+    user = _user_cache.get(uid) or client.get_user(uid)
+    if user is not None:
+        _user_cache[uid] = user
+        return user
+    async with _user_fetch_locks[uid]:
+        user = _user_cache.get(uid)
+        if user is None:
+            user = await client.fetch_user(uid)
+            _user_cache[uid] = user
+    return user
 
 async def send_reply(uid: int, reply: str) -> None:
-    user = client.get_user(uid) or await client.fetch_user(uid)
-    await user.send(reply)
+    user = await resolve_user(uid)
+    try:
+        await user.send(reply)
+    except discord.NotFound:
+        _user_cache.pop(uid, None)
+        _dm_cache.pop(uid, None)
+        raise
+
+# Send and record in one coroutine so the CLI makes a single hop onto the loop per message,
+# and a send that completes after the CLI stops waiting is still recorded
+async def deliver_reply(uid: int, text: str) -> None:
+    await send_reply(uid, text)
+    record_message(uid, "You", text)
+    add_known_user(uid)
+
+# Queues a reply for _outbox_loop and waits until it has been sent (or failed)
+async def submit_reply(uid: int, text: str) -> None:
+    fut = asyncio.get_running_loop().create_future()
+    await outbox.put((uid, text, fut))
+    await fut
+
+async def _outbox_loop():
+    while True:
+        uid, text, fut = await outbox.get()
+        try:
+            if fut.cancelled():
+                # The submitter gave up before this reply reached the front of the queue
+                continue
+            await deliver_reply(uid, text)
+            if not fut.done():
+                fut.set_result(None)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        finally:
+            outbox.task_done()
 
 # --------- Discord events ---------
+_DMChannel = discord.DMChannel
+
 @client.event
 async def on_ready():
-    global bot_status, bot_ready_event
+    global bot_status, bot_ready_event, persist_task
     with bot_status_lock:
         bot_status = f"Connected as {client.user}"
+    ui_dirty.set()
     logger.info("Bot ready: %s", client.user)
-    await asyncio.to_thread(load_conversations_sync)
+    # on_ready fires again after reconnects; state is loaded once in main()
+    if persist_task is None or persist_task.done():
+        persist_task = asyncio.create_task(_persist_loop())
+    bot_ready_flag.set()
     if bot_ready_event is not None and not bot_ready_event.is_set():
         bot_ready_event.set()
 
 @client.event
 async def on_message(message):
-    global unread_count
-    if isinstance(message.channel, discord.DMChannel) and not message.author.bot:
-        incoming_queue.put((message.author, message.content))
-        with unread_lock:
-            unread_count += 1
-        with conversations_lock:
-            conversations.setdefault(message.author.id, []).append(f"{message.author}: {message.content}")
-        asyncio.create_task(save_conversations())
-        known = set(load_known_users())
-        known.add(message.author.id)
-        asyncio.create_task(save_known_users(sorted(list(known))))
+    global unread_total
+    author = message.author
+    # DMChannel has no subclasses, so an identity check on the type is enough
+    if author.bot or type(message.channel) is not _DMChannel:
+        return
+    uid = author.id
+    with unread_lock:
+        unread_by_user[uid] += 1
+        unread_total += 1
+    invalidate_summary()
+    ui_dirty.set()
+    record_message(uid, str(author), message.content)
+    add_known_user(uid)
 
 # ----------- Reload task -----------
 async def reload_all_histories(semaphore_limit: int = HISTORY_CONCURRENCY, limit_per_channel: Optional[int] = HISTORY_FETCH_LIMIT):
     logger.info("Starting reload_all_histories (limit=%s, concurrency=%s)", limit_per_channel, semaphore_limit)
-    sem = asyncio.Semaphore(semaphore_limit)
-    known_ids = set(load_known_users())
+    # Admission caps concurrent fetches (shrinking on 429s); one shared bucket caps the total request rate
+    admission = AdmissionController(semaphore_limit)
+    limiter = RateLimiter(HISTORY_RATE_LIMIT)
+    with known_users_lock:
+        known_ids = set(known_users)
+    # Reuse DM channels already cached by the gateway so those users skip fetch_user/create_dm
+    dm_channels = {}
     for ch in client.private_channels:
         if isinstance(ch, discord.DMChannel) and ch.recipient:
             known_ids.add(ch.recipient.id)
+            dm_channels[ch.recipient.id] = ch
 
     async def fetch_for_uid(uid: int):
-        async with sem:
+        async with admission:
             try:
-                user = client.get_user(uid) or await client.fetch_user(uid)
-                channel = user.dm_channel or await user.create_dm()
+                channel = dm_channels.get(uid) or _dm_cache.get(uid)
+                if channel is None:
+                    user = await call_rate_limited(limiter, "user", lambda: resolve_user(uid), admission)
+                    channel = user.dm_channel or await call_rate_limited(limiter, "dm", user.create_dm, admission)
+                    if channel is not None:
+                        _dm_cache[uid] = channel
                 if channel is None:
-                    return uid, []
-                history = await fetch_channel_history(channel, limit=limit_per_channel)
-                texts = [f"{m.author}: {m.content}" for m in history]
+                    return
+                texts = await call_rate_limited(limiter, "history", lambda: fetch_channel_history_entries(channel, limit=limit_per_channel), admission)
                 logger.info("Fetched %d messages for %s", len(texts), uid)
-                return uid, texts
+            except discord.NotFound as e:
+                _user_cache.pop(uid, None)
+                _dm_cache.pop(uid, None)
+                logger.warning("Not found fetching history for %s: %s", uid, e)
+                return
             except discord.HTTPException as e:
                 logger.warning("HTTP error fetching history for %s: %s", uid, e)
-                return uid, []
+                return
             except Exception as e:
                 logger.exception("Unexpected error fetching history for %s: %s", uid, e)
-                return uid, []
+                return
+        # Stored as soon as this user finishes, so a timeout keeps every completed fetch and
+        # finished histories are not held until the slowest one returns
+        if texts:
+            with conversations_lock:
+                conversations[uid] = texts
+                conversation_versions[uid] = conversation_versions.get(uid, 0) + 1
+            invalidate_summary()
+            updated_uids.append(uid)
 
+    updated_uids = []
     tasks = [asyncio.create_task(fetch_for_uid(uid)) for uid in sorted(known_ids)]
-    results = []
     try:
-        results = await asyncio.wait_for(asyncio.gather(*tasks), timeout=HISTORY_FETCH_TIMEOUT)
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=HISTORY_FETCH_TIMEOUT)
     except asyncio.TimeoutError:
-        logger.warning("Reload timed out; gathering partial results.")
+        logger.warning("Reload timed out; keeping conversations fetched so far.")
         for t in tasks:
             if not t.done():
                 t.cancel()
-        done, _ = await asyncio.wait(tasks, timeout=5)
-        for d in done:
-            try:
-                results.append(d.result())
-            except Exception:
-                pass
+        await asyncio.wait(tasks, timeout=5)
 
-    updated = 0
-    with conversations_lock:
-        for uid, texts in results:
-            if texts:
-                conversations[uid] = texts
-                updated += 1
-
-    drained = []
-    while True:
-        try:
-            author, content = incoming_queue.get_nowait()
-        except queue.Empty:
-            break
-        with unread_lock:
-            global unread_count
-            if unread_count > 0:
-                unread_count -= 1
-        with conversations_lock:
-            conversations.setdefault(author.id, []).append(f"{author}: {content}")
-        drained.append((author, content))
-        known = set(load_known_users())
-        known.add(author.id)
-        await save_known_users(sorted(list(known)))
+    # DM partners found only in the gateway cache are folded in with a single known-users write
+    add_known_users(updated_uids)
 
     await save_conversations()
-    logger.info("Reload complete: updated %d conversations, drained %d queued messages", updated, len(drained))
-    return {"updated": updated, "drained": len(drained)}
+    logger.info("Reload complete: updated %d conversations", len(updated_uids))
+    return {"updated": len(updated_uids)}
 
 # ---------- Color helpers ----------
-def c_header(text: str):
-    if COLORAMA_AVAILABLE:
-        return f"{Style.BRIGHT}{Fore.CYAN}{text}{Style.RESET_ALL}"
-    return text
-
-def c_info(text: str):
-    if COLORAMA_AVAILABLE:
-        return f"{Fore.BLUE}{text}{Style.RESET_ALL}"
-    return text
-
-def c_success(text: str):
-    if COLORAMA_AVAILABLE:
-        return f"{Fore.GREEN}{text}{Style.RESET_ALL}"
-    return text
-
-def c_warn(text: str):
-    if COLORAMA_AVAILABLE:
-        return f"{Fore.YELLOW}{text}{Style.RESET_ALL}"
-    return text
-
-def c_error(text: str):
-    if COLORAMA_AVAILABLE:
-        return f"{Fore.RED}{Style.BRIGHT}{text}{Style.RESET_ALL}"
-    return text
-
-def c_prompt(text: str):
-    if COLORAMA_AVAILABLE:
-        return f"{Fore.MAGENTA}{text}{Style.RESET_ALL}"
-    return text
+# Bound str.format of a template resolved once at import, so each call is a single format
+if COLORAMA_AVAILABLE:
+    c_header = f"{Style.BRIGHT}{Fore.CYAN}{{}}{Style.RESET_ALL}".format
+    c_info = f"{Fore.BLUE}{{}}{Style.RESET_ALL}".format
+    c_success = f"{Fore.GREEN}{{}}{Style.RESET_ALL}".format
+    c_warn = f"{Fore.YELLOW}{{}}{Style.RESET_ALL}".format
+    c_error = f"{Fore.RED}{Style.BRIGHT}{{}}{Style.RESET_ALL}".format
+    c_prompt = f"{Fore.MAGENTA}{{}}{Style.RESET_ALL}".format
+else:
+    c_header = c_info = c_success = c_warn = c_error = c_prompt = "{}".format
 
 # -------- CLI (synchronous) --------
+SPINNER = "|/-\\"
+UI_REFRESH_INTERVAL = 0.25
+# 1-based terminal row of the first status line (after the three header lines)
+STATUS_ROW = 4
+
+# TextWrapper instances keyed by width; textwrap.wrap() builds a new one per call
+_wrappers = {}
+
+def get_wrapper(width: int) -> textwrap.TextWrapper:
+    wrapper = _wrappers.get(width)
+    if wrapper is None:
+        wrapper = _wrappers[width] = textwrap.TextWrapper(width=width)
+    return wrapper
+
 def wrap_text(text: str, width: int = 80) -> str:
     paragraphs = text.splitlines() or [""]
+    wrapper = get_wrapper(width)
     wrapped = []
     for p in paragraphs:
         if not p:
             wrapped.append("")
+        elif len(p) <= width and "\t" not in p:
+            # Short lines (most DMs) fit as-is
+            wrapped.append(p)
         else:
-            wrapped.extend(textwrap.wrap(p, width=width) or [""])
+            wrapped.extend(wrapper.wrap(p) or [""])
     return "\n".join(wrapped)
 
+# Cursor home + erase to end of screen: repaints in place instead of blanking the terminal
+CLEAR_SEQ = "\x1b[H\x1b[J"
+
 def clear_screen():
-    if os.name == "nt":
+    if os.name == "nt" and not COLORAMA_AVAILABLE:
+        # Legacy Windows consoles only understand ANSI through colorama
         os.system("cls")
-    else:
-        os.system("clear")
+        return
+    sys.stdout.write(CLEAR_SEQ)
+    sys.stdout.flush()
+
+# Static parts of the main menu, colored once at import
+HEADER_TEXT = "\n".join([
+    c_header("=" * 40),
+    c_header("Discord DM Relay Bot".center(40)),
+    c_header("=" * 40),
+])
+MENU_TEXT = "\n".join([
+    "",
+    c_prompt("Menu:"),
+    c_info("1) Conversations"),
+    c_info("2) Select Conversation"),
+    c_info("3) New Conversation"),
+    c_info("4) Change Token"),
+    c_info("5) Reload Messages (Full History)"),
+    c_info("6) GitHub Update"),
+    c_info("7) Exit"),
+    "",
+    "",
+])
 
 def print_header():
-    print(c_header("=" * 40))
-    print(c_header("Discord DM Relay Bot".center(40)))
-    print(c_header("=" * 40))
+    print(HEADER_TEXT)
 
-def show_menu():
-    print_header()
+def status_lines():
     with bot_status_lock:
         status = bot_status
-    print(c_info(f"Status: {status}"))
     with unread_lock:
-        uc = unread_count
-    print(c_warn(f"Unread messages: {uc}"))
-    print()
-    print(c_prompt("Menu:"))
-    print(c_info("1) Conversations"))
-    print(c_info("2) Select Conversation"))
-    print(c_info("3) New Conversation"))
-    print(c_info("4) Change Token"))
-    print(c_info("5) Reload Messages (Full History)"))
-    print(c_info("6) GitHub Update"))
-    print(c_info("7) Exit"))
-    print()
+        uc = unread_total
+    return c_info(f"Status: {status}"), c_warn(f"Unread messages: {uc}")
+
+# Status lines currently on screen, so a wakeup that changed nothing visible skips the repaint
+_drawn_status = None
+
+def show_menu():
+    global _drawn_status
+    ui_dirty.clear()
+    _drawn_status = status_lines()
+    # One write per frame; only the status lines are formatted each time
+    sys.stdout.write("\n".join([HEADER_TEXT, *_drawn_status, MENU_TEXT]))
+    sys.stdout.flush()
+
+def redraw_status_lines():
+    global _drawn_status
+    lines = status_lines()
+    if lines == _drawn_status:
+        return
+    _drawn_status = lines
+    # Save cursor, rewrite the status rows below the header, restore cursor so typed input is kept
+    out = ["\x1b7"]
+    for row, line in enumerate(lines, start=STATUS_ROW):
+        out.append(f"\x1b[{row};1H{line}\x1b[K")
+    out.append("\x1b8")
+    sys.stdout.write("".join(out))
+    sys.stdout.flush()
+
+def read_menu_choice(prompt: str) -> str:
+    if os.name == "nt" or not sys.stdin.isatty():
+        return input(prompt)
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    while True:
+        ready, _, _ = select.select([sys.stdin], [], [], UI_REFRESH_INTERVAL)
+        if ready:
+            line = sys.stdin.readline()
+            if not line:
+                raise EOFError
+            return line.rstrip("\n")
+        if ui_dirty.is_set():
+            ui_dirty.clear()
+            redraw_status_lines()
 
 def list_conversations():
-    with conversations_lock:
-        if not conversations:
-            print(c_warn("No conversations available."))
-            return
-        for uid, msgs in conversations.items():
-            print(c_info(f"- User {uid}: {len(msgs)} messages"))
+    global _summary_lines, _summary_dirty
+    if _summary_dirty:
+        # Clear first so a change made while rebuilding triggers another rebuild
+        _summary_dirty = False
+        with unread_lock:
+            unread = dict(unread_by_user)
+        # Only take the counts under the lock; format after releasing it
+        with conversations_lock:
+            counts = [(uid, len(msgs)) for uid, msgs in conversations.items()]
+        # Kept uncolored so they can be cut to the terminal width before the color codes go on
+        lines = []
+        for uid, count in counts:
+            line = f"- User {uid}: {count} messages"
+            if unread.get(uid):
+                lines.append((f"{line} ({unread[uid]} unread)", c_warn))
+            else:
+                lines.append((line, c_info))
+        _summary_lines = lines
+    if not _summary_lines:
+        print(c_warn("No conversations available."))
+        return
+    if sys.stdout.isatty():
+        # Cut to the terminal width so long lines don't wrap; the user ID leads each line
+        cols = shutil.get_terminal_size().columns
+        out = [color(text[:cols - 1]) for text, color in _summary_lines]
+    else:
+        out = [color(text) for text, color in _summary_lines]
+    print("\n".join(out))
 
 def show_conversation(uid: int):
     with conversations_lock:
-        msgs = conversations.get(uid, [])
-    if not msgs:
+        version = conversation_versions.get(uid, 0)
+        cached = rendered_cache.get(uid)
+        if cached is not None and cached[0] == version:
+            msgs = None
+        else:
+            # Copy the tail while locked; the deque may be appended to concurrently
+            buf = conversations.get(uid, ())
+            msgs = list(islice(buf, max(0, len(buf) - CONVERSATION_DISPLAY_LIMIT), None))
+    if msgs is None:
+        rendered = cached[1]
+    else:
+        rendered = [wrap_text(format_entry(entry), width=80) for entry in msgs]
+        rendered_cache[uid] = (version, rendered)
+    if not rendered:
         print(c_warn("No messages in this conversation."))
         return
-    for msg in msgs[-200:]:
-        print(wrap_text(msg, width=80))
+    for text in rendered:
+        print(text)
         print(c_info("-" * 40))
 
-def drain_incoming_queue_to_conversations():
-    drained = []
-    while True:
-        try:
-            author, content = incoming_queue.get_nowait()
-        except queue.Empty:
-            break
-        with unread_lock:
-            global unread_count
-            if unread_count > 0:
-                unread_count -= 1
-        with conversations_lock:
-            conversations.setdefault(author.id, []).append(f"{author}: {content}")
-        drained.append((author, content))
-        known = set(load_known_users())
-        known.add(author.id)
-        save_known_users_sync(sorted(list(known)))
-    if drained:
-        save_conversations_sync()
-    return drained
+def mark_read(uid: int):
+    global unread_total
+    with unread_lock:
+        count = unread_by_user.pop(uid, 0)
+        unread_total -= count
+    if count:
+        invalidate_summary()
+
+close_task: Optional[asyncio.Task] = None
+
+def _start_close():
+    global close_task
+    # Kept in a global so the task isn't garbage-collected before client.close() finishes
+    close_task = asyncio.create_task(client.close())
+
+def request_close(loop: asyncio.AbstractEventLoop):
+    # Fire-and-forget from the CLI thread: nothing reads the result, so skip the
+    # concurrent.futures.Future that run_coroutine_threadsafe would chain up
+    try:
+        loop.call_soon_threadsafe(_start_close)
+    except RuntimeError:
+        # Loop already closed; the bot is shutting down anyway
+        pass
 
 def run_cli(loop: asyncio.AbstractEventLoop):
     reload_future = None
     try:
-        if bot_ready_event is not None and not bot_ready_event.is_set():
+        if not bot_ready_flag.is_set():
             clear_screen()
             print(c_info("Waiting for bot to connect... (you can wait or press Enter to continue)"))
-            bot_ready_event.wait(timeout=10)
+            bot_ready_flag.wait(timeout=10)
 
         while not shutdown_event.is_set():
             clear_screen()
-            drained = drain_incoming_queue_to_conversations()
-            if drained:
-                print(c_success(f"Drained {len(drained)} incoming messages into conversations."))
-
             show_menu()
-            choice = input(c_prompt("Select option: ")).strip()
+            choice = read_menu_choice(c_prompt("Select option: ")).strip()
 
             if choice == "1":
                 clear_screen()
@@ -405,18 +1172,18 @@ def run_cli(loop: asyncio.AbstractEventLoop):
                 clear_screen()
                 print(c_header(f"=== Conversation with {uid} ==="))
                 show_conversation(uid)
+                mark_read(uid)
                 reply = input(c_prompt("\nType reply (leave blank to skip): ")).strip()
                 if reply:
-                    fut = asyncio.run_coroutine_threadsafe(send_reply(uid, reply), loop)
+                    fut = asyncio.run_coroutine_threadsafe(submit_reply(uid, reply), loop)
                     try:
-                        fut.result(timeout=20)
-                        with conversations_lock:
-                            conversations.setdefault(uid, []).append(f"You: {reply}")
-                        asyncio.run_coroutine_threadsafe(save_conversations(), loop)
-                        known = set(load_known_users())
-                        known.add(uid)
-                        asyncio.run_coroutine_threadsafe(save_known_users(sorted(list(known))), loop)
+                        fut.result(timeout=REPLY_TIMEOUT)
                         print(c_success("Reply sent."))
+                    except TimeoutError:
+                        # Withdraws the reply if it is still queued; one already being sent
+                        # finishes and is recorded
+                        fut.cancel()
+                        print(c_error(f"Timed out after {REPLY_TIMEOUT}s; the reply may still be delivered."))
                     except Exception as e:
                         print(c_error(f"Failed to send reply: {e}"))
                 input(c_prompt("Press Enter to return to menu..."))
@@ -434,16 +1201,13 @@ def run_cli(loop: asyncio.AbstractEventLoop):
                     print(c_warn("No message entered."))
                     input(c_prompt("Press Enter to continue..."))
                     continue
-                fut = asyncio.run_coroutine_threadsafe(send_reply(uid, msg), loop)
+                fut = asyncio.run_coroutine_threadsafe(submit_reply(uid, msg), loop)
                 try:
-                    fut.result(timeout=20)
-                    with conversations_lock:
-                        conversations.setdefault(uid, []).append(f"You: {msg}")
-                    asyncio.run_coroutine_threadsafe(save_conversations(), loop)
-                    known = set(load_known_users())
-                    known.add(uid)
-                    asyncio.run_coroutine_threadsafe(save_known_users(sorted(list(known))), loop)
+                    fut.result(timeout=REPLY_TIMEOUT)
                     print(c_success("Message sent."))
+                except TimeoutError:
+                    fut.cancel()
+                    print(c_error(f"Timed out after {REPLY_TIMEOUT}s; the message may still be delivered."))
                 except Exception as e:
                     print(c_error(f"Failed to send message: {e}"))
                 input(c_prompt("Press Enter to return to menu..."))
@@ -455,10 +1219,7 @@ def run_cli(loop: asyncio.AbstractEventLoop):
                     print(c_success("Token saved. Please restart the program to use the new token."))
                     input(c_prompt("Press Enter to exit..."))
                     shutdown_event.set()
-                    try:
-                        asyncio.run_coroutine_threadsafe(client.close(), loop)
-                    except Exception:
-                        pass
+                    request_close(loop)
                     break
                 else:
                     print(c_warn("No token entered."))
@@ -487,20 +1248,30 @@ def run_cli(loop: asyncio.AbstractEventLoop):
                 input(c_prompt("Press Enter to return to menu..."))
 
             elif choice == "6":
-                print(c_info("\nRunning git pull in ~/Discord-DM-Bot ..."))
+                print(c_info("\nChecking for updates in ~/Discord-DM-Bot ..."))
+                fut = asyncio.run_coroutine_threadsafe(git_pull(UPDATE_REPO_DIR), loop)
                 try:
-                    result = subprocess.run(
-                        ["git", "pull", "origin", "main"],
-                        capture_output=True, text=True, cwd=os.path.expanduser("~/Discord-DM-Bot")
-                    )
-                    out = result.stdout.strip() or "(no output)"
-                    err = result.stderr.strip()
+                    frame = 0
+                    while not fut.done():
+                        sys.stdout.write("\r" + c_info(f"Pulling... {SPINNER[frame % len(SPINNER)]}"))
+                        sys.stdout.flush()
+                        frame += 1
+                        try:
+                            fut.result(timeout=0.1)
+                        except asyncio.TimeoutError:
+                            pass
+                    sys.stdout.write("\r\x1b[K")
+                    out, err = fut.result()
+                    out = out.strip() or "(no output)"
+                    err = err.strip()
                     print(c_info("\n--- git output ---"))
                     print(out)
                     if err:
                         print(c_error("\n--- git errors ---"))
                         print(err)
                     print(c_success("\nUpdate complete."))
+                except asyncio.TimeoutError:
+                    print(c_error(f"Git update timed out after {GIT_PULL_TIMEOUT}s."))
                 except Exception as e:
                     print(c_error(f"Git update failed: {e}"))
                 input(c_prompt("Press Enter to return to menu..."))
@@ -508,10 +1279,7 @@ def run_cli(loop: asyncio.AbstractEventLoop):
             elif choice == "7":
                 print(c_info("Exiting..."))
                 shutdown_event.set()
-                try:
-                    asyncio.run_coroutine_threadsafe(client.close(), loop)
-                except Exception:
-                    pass
+                request_close(loop)
                 break
 
             else:
@@ -521,21 +1289,24 @@ def run_cli(loop: asyncio.AbstractEventLoop):
     except KeyboardInterrupt:
         logger.info("CLI interrupted by user.")
         shutdown_event.set()
-        try:
-            asyncio.run_coroutine_threadsafe(client.close(), loop)
-        except Exception:
-            pass
+        request_close(loop)
 
 # --------- Main entrypoint ---------
 async def main():
-    global bot_ready_event
+    global bot_ready_event, main_loop, outbox_task
     bot_ready_event = asyncio.Event()
+    loop = main_loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="dm-io"))
 
     await asyncio.to_thread(load_conversations_sync)
+    await asyncio.to_thread(load_known_users_sync)
 
     token = get_token_interactive()
-    loop = asyncio.get_running_loop()
+    if sys.version_info >= (3, 12):
+        # Short-lived tasks (event dispatch, replies) run inline until their first await
+        loop.set_task_factory(asyncio.eager_task_factory)
 
+    outbox_task = asyncio.create_task(_outbox_loop())
     client_task = asyncio.create_task(client.start(token))
 
     try:
@@ -544,13 +1315,23 @@ async def main():
     except asyncio.TimeoutError:
         logger.warning("Bot did not become ready within timeout; starting CLI anyway. Logs will appear on stderr.")
 
-    cli_thread = threading.Thread(target=run_cli, args=(loop,), daemon=True)
+    # Own thread rather than asyncio.to_thread so disk flushes on the default executor can't delay the UI
+    cli_thread = threading.Thread(target=run_cli, args=(loop,), name="cli", daemon=True)
     cli_thread.start()
 
     try:
         await client_task
     finally:
         shutdown_event.set()
+        if persist_task is not None:
+            persist_task.cancel()
+        outbox_task.cancel()
+        await asyncio.to_thread(flush_dirty_sync)
+        if _journal_records:
+            # Leave a compact snapshot behind so the next start has nothing to replay
+            await save_conversations()
+        if _known_log_records:
+            await asyncio.to_thread(save_known_users_sync)
         if cli_thread.is_alive():
             cli_thread.join(timeout=2)
 